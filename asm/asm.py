@@ -52,16 +52,23 @@ OPCODES = {
     "SHR":  {"type": 2, "code": "10101101"},
     "ST":   {"type": 2, "code": "10000100"},
     "SUB":  {"type": 2, "code": "10100001"},
+    "TAS":  {"type": 2, "code": "10001000"},
     "XOR":  {"type": 2, "code": "10101011"},
 }
 
+# Regexes are compiled once at import time and shared by every line
+
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+REGEX = re.compile(
+    r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?")
 
 # Regex for capturing DS and DB data
-REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
-REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+REGEX_DS = re.compile(r"(?:(\w+?):)?\s*DS\s*(.+)", re.IGNORECASE)
+REGEX_DB = re.compile(r"(?:(\w+?):)?\s*DB\s*(.+)", re.IGNORECASE)
+
+# Regex for matching register operands
+REGEX_REG = re.compile(r"R([0-7])")
 
 
 def parse_commandline(argv):
@@ -148,7 +155,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal line_num
 
-        m = re.match(r"R([0-7])", op)
+        m = REGEX_REG.match(op)
 
         if m is None:
             if fatal:
@@ -220,7 +227,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+        m = REGEX_DS.match(line)
 
         if m is None or m.group(2) is None:
             print(f"line {line_num}: missing argument to DS", file=sys.stderr)
@@ -245,7 +252,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        m = REGEX_DB.match(line)
 
         if m is None or m.group(2) is None:
             print(f"line {line}: missing argument to DB", file=sys.stderr)
@@ -330,7 +337,7 @@ def pass1(inputfile, sym, code):
 
         # print(line)  # debug
 
-        m = re.match(REGEX, line)
+        m = REGEX.match(line)
 
         if m is not None:
             label, opcode, op_a, op_b = normalize_line(m.groups())
@@ -0,0 +1,35 @@
+; Spinlock shared between cores
+;
+; Run it on several cores, e.g. `python ls8.py --cores 2 examples/spinlock.ls8`.
+; Every core takes the lock with TAS before printing, so the two numbers
+; printed by a core are never split up by another core.
+;
+; Expected output with 2 cores:
+; 1
+; 2
+; 1
+; 2
+
+    LDI R0,Lock      ; Address of the lock
+    LDI R2,1         ; Value of a taken lock
+    LDI R3,Acquire
+
+Acquire:
+    TAS R1,R0        ; Read the old lock value and take the lock
+    CMP R1,R2
+    JEQ R3           ; Somebody else holds the lock, spin
+
+    ; critical section
+
+    LDI R1,1
+    PRN R1
+    LDI R1,2
+    PRN R1
+
+    LDI R1,0
+    ST R0,R1         ; Release the lock
+
+    HLT
+
+Lock:
+    DB 0
@@ -0,0 +1,39 @@
+; Spinlock taken and released in a loop by every core
+;
+; Run it on several cores, e.g.
+; `python ls8.py --cores 4 --parallel examples/spinloop.ls8`.
+; Every core takes and releases the lock 255 * 20 times, then halts. If a
+; release were ever lost the lock would stay taken and the cores would spin
+; forever.
+;
+; Expected output: nothing, and every core halts.
+
+    LDI R0,Lock      ; Address of the lock
+    LDI R2,1         ; Value of a taken lock
+    LDI R3,Acquire
+    LDI R4,0         ; Inner count, 0 wraps around to 255
+    LDI R5,0         ; Value of a free lock, and the end of a count
+    LDI R6,20        ; Outer count
+
+Acquire:
+    TAS R1,R0        ; Read the old lock value and take the lock
+    CMP R1,R2
+    JEQ R3           ; Somebody else holds the lock, spin
+
+    ST R0,R5         ; Release the lock
+
+    LDI R1,0xFF      ; Count down by adding -1
+    ADD R4,R1
+    AND R4,R1        ; Keep the count to a byte
+    CMP R4,R5
+    JNE R3           ; Inner loop
+
+    ADD R6,R1        ; Count the outer loop down
+    AND R6,R1
+    CMP R6,R5
+    JNE R3           ; Outer loop
+
+    HLT
+
+Lock:
+    DB 0
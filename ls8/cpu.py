@@ -1,15 +1,81 @@
 """CPU functionality."""
 
+import contextlib
 import sys
 
+# Store the numeric values of opcodes once, shared by every CPU
+# set the variable HLT to numeric value
+HLT = 0b00000001
+# set the variable LDI to numeric value
+LDI = 0b10000010
+# set the variable PRN to numeric value
+PRN = 0b01000111
+# set the variable PUSH to its numeric  value
+PUSH = 0b01000101
+# set the variable POP to its numeric  value
+POP = 0b01000110
+# set the CALL to its numeric  value
+CALL = 0b01010000
+# set the RET to its numeric  value
+RET = 0b00010001
+# set the variable MUL to it's numeric value
+MUL = 0b10100010
+# set the variable ADD to it's numeric value
+ADD = 0b10100000
+# set the variable CMP to it's numeric value
+CMP = 0b10100111
+# set the variable JMP to it's numeric value
+JMP = 0b01010100
+# set the variable JEQ to it's numeric value
+JEQ = 0b01010101
+# set the variable JEQ to it's numeric value
+JNE = 0b01010110
+# set the variable ST to it's numeric value
+ST = 0b10000100
+# set the variable AND to it's numeric value
+AND = 0b10101000
+# set the variable OR to it's numeric value
+OR = 0b10101010
+# set the variable XOR to it's numeric value
+XOR = 0b10101011
+# set the variable TAS to it's numeric value
+TAS = 0b10001000
+
+# The start of the interrupt vector table, I0 to I7 live at F8 to FF
+VECTOR_TABLE = 0xF8
+
+
+class MemoryFault(Exception):
+    """Raised when a write hits a protected region of memory."""
+
+    def __init__(self, kind, pc, address):
+        super().__init__(
+            f"{kind} fault: write to address {address:#04x} at PC {pc:#04x}")
+        # the kind of region written to: "code", "stack" or "vector"
+        self.kind = kind
+        # the address of the instruction doing the write
+        self.pc = pc
+        # the address written to
+        self.address = address
+
 
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
-        # set memory to a list of 256 zeros
-        self.ram = [0] * 256
+    def __init__(self, ram=None, lock=None):
+        """
+        Construct a new CPU. Pass in ram (any mutable sequence of 256 bytes)
+        and lock to share memory with other cores
+        """
+        # set memory to a list of 256 zeros, unless a shared ram is given
+        self.ram = [0] * 256 if ram is None else ram
+        # the lock every write to shared ram takes, so TAS stays atomic with
+        # respect to plain stores from other host processes. It must be
+        # reentrant since TAS writes while holding it
+        self.lock = lock
+        # a CPU sharing ram with other processes writes under the lock
+        if lock is not None:
+            self.ram_write = self.locked_ram_write
         # set registers to a list of 8 zeros
         self.reg = [0] * 8
         # R7 is reserved as the stack pointer (SP)
@@ -21,104 +87,121 @@ class CPU:
         self.flag = 0
         # set instruction_size to default 1
         self.instruction_size = 1
-
-        # Store the numeric values of opcodes
-        # set the variable HLT to numeric value
-        HLT = 0b00000001
-        # set the variable LDI to numeric value
-        LDI = 0b10000010
-        # set the variable PRN to numeric value
-        PRN = 0b01000111
-        # set the variable PUSH to its numeric  value
-        PUSH = 0b01000101
-        # set the variable POP to its numeric  value
-        POP = 0b01000110
-        # set the CALL to its numeric  value
-        CALL = 0b01010000
-        # set the RET to its numeric  value
-        RET = 0b00010001
-        # set the variable MUL to it's numeric value
-        MUL = 0b10100010
-        # set the variable ADD to it's numeric value
-        ADD = 0b10100000
-        # set the variable CMP to it's numeric value
-        CMP = 0b10100111
-        # set the variable JMP to it's numeric value
-        JMP = 0b01010100
-        # set the variable JEQ to it's numeric value
-        JEQ = 0b01010101
-        # set the variable JEQ to it's numeric value
-        JNE = 0b01010110
-        # set the variable ST to it's numeric value
-        ST = 0b10000100
-        # set the variable AND to it's numeric value
-        AND = 0b10101000
-        # set the variable OR to it's numeric value
-        OR = 0b10101010
-        # set the variable XOR to it's numeric value
-        XOR = 0b10101011
-
-        # set up the branch table
-        self.branch_table = {
-            HLT: self.handle_hlt,
-            LDI: self.handle_ldi,
-            PRN: self.handle_prn,
-            PUSH: self.handle_push,
-            POP: self.handle_pop,
-            CALL: self.handle_call,
-            RET: self.handle_ret,
-            MUL: self.handle_mul,
-            ADD: self.handle_add,
-            CMP: self.handle_cmp,
-            JMP: self.handle_jmp,
-            JEQ: self.handle_jeq,
-            JNE: self.handle_jne,
-            ST: self.handle_st,
-            AND: self.handle_and,
-            OR: self.handle_or,
-            XOR: self.handle_xor
-        }
+        # the CPU is not halted on power on
+        self.halted = False
+        # the labels found in the assembler comments, keyed by address
+        self.labels = {}
+        # the number of bytes loaded by load_program
+        self.program_size = 0
 
     def load(self, filename):
         """Load a program into memory."""
 
         # handle exception with a try/except block
         try:
-            # initialize address to zero
-            address = 0
-
             # open file name using the with command
             with open(filename, "r") as f:
-                # loop through every line in f
-                for line in f:
-                    # split the line on an #
-                    split_line = line.split("#")
-                    # initialize command to the left item in the split operation
-                    # and call strip on it
-                    command = split_line[0].strip()
-
-                    # check if command is an empty string
-                    if command == "":
-                        # it's a comment, continue
-                        continue
-
-                    # convert the binary command to integer using the int function
-                    command = int(command, 2)
-                    # add command to self.ram at index address
-                    self.ram_write(command, address)
-                    # increment address
-                    address += 1
+                # load every line in f
+                self.load_program(f)
         except FileNotFoundError:
             # print error message
             print(f"Error: No such file or directory: {filename}")
             # call sys.exit with a positive integer
             sys.exit(1)
 
+    def load_program(self, lines):
+        """Load a program from an iterable of .ls8 lines into memory."""
+        # initialize address to zero
+        address = 0
+
+        # loop through every line in lines
+        for line in lines:
+            # split the line on an #
+            split_line = line.split("#")
+            # initialize command to the left item in the split operation
+            # and call strip on it
+            command = split_line[0].strip()
+
+            # check if command is an empty string
+            if command == "":
+                # it's a comment, keep the label if the assembler left one
+                # in the form "# LABEL (address N):"
+                comment = line.partition("#")[2].strip()
+                name, _, label_address = comment.partition(" (address ")
+                if name and label_address.endswith("):"):
+                    label_address = label_address[:-2]
+                    if label_address.isdigit():
+                        self.labels[int(label_address)] = name
+                continue
+
+            # convert the binary command to integer using the int function
+            command = int(command, 2)
+            # add command to self.ram at index address
+            self.ram_write(command, address)
+            # increment address
+            address += 1
+
+        # remember where the program ends
+        self.program_size = address
+
+    def protect(self, code=None, stack_limit=None, vectors=False):
+        """
+        Protect regions of memory against writes. code is a (start, end)
+        range of addresses holding instructions, end excluded. The loaded
+        image is not protected as a whole since DB and DS data may follow
+        the code. stack_limit is the lowest address the stack may grow to, from 1 to
+        0xFF, the byte below it becomes a guard. vectors protects the
+        interrupt vector table, so only set it once the program's handlers
+        are installed, since programs install them with ST.
+
+        Protected writes raise MemoryFault. Reads are never checked, and
+        running under `python -O` compiles the checks out entirely.
+        """
+        # protection is compiled out in optimized mode
+        if __debug__:
+            # the code range must fit in memory
+            if code is not None:
+                start, end = code
+                if not 0 <= start <= end <= 256:
+                    raise ValueError(f"Invalid code range {start}-{end}")
+
+            # the guard byte below the stack limit must be in memory
+            if stack_limit is not None and not 1 <= stack_limit <= 0xFF:
+                raise ValueError(f"Invalid stack limit {stack_limit}")
+
+            # the kind of fault raised by a write to each address, None when
+            # the address is writable. Built on the first call, so a CPU that
+            # is never protected does not pay for it
+            if not hasattr(self, "fault_map"):
+                self.fault_map = [None] * 256
+
+            # protect the code range
+            if code is not None:
+                for address in range(start, end):
+                    self.fault_map[address] = "code"
+
+            # the byte below the stack limit guards against overflows
+            if stack_limit is not None:
+                self.fault_map[stack_limit - 1] = "stack"
+
+            # protect the interrupt vector table
+            if vectors:
+                for address in range(VECTOR_TABLE, 256):
+                    self.fault_map[address] = "vector"
+
+            # route every write through the checked path, which then writes
+            # with the writer in use so far, e.g. the locked one of a core
+            # sharing ram. A CPU that is never protected keeps the plain
+            # ram_write
+            if self.ram_write != self.checked_ram_write:
+                self.unchecked_ram_write = self.ram_write
+                self.ram_write = self.checked_ram_write
+
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
         # find the appropriate method with the branch_table
         if op in self.branch_table:
-            self.branch_table[op](reg_a, reg_b)
+            self.branch_table[op](self, reg_a, reg_b)
         # raise an exception if the op is not supported
         else:
             raise Exception("Unsupported ALU operation")
@@ -137,7 +220,29 @@ class CPU:
         the ram
         """
         # write memory_data to index memory_address of ram
-        self.ram[memory_address] = memory_data
+        # mask it to a byte since memory cells are 8 bits wide
+        self.ram[memory_address] = memory_data & 0xFF
+
+    def locked_ram_write(self, memory_data, memory_address):
+        """
+        Writes memory_data to index memory_address of the ram while holding
+        the lock shared with the other cores
+        """
+        with self.lock:
+            self.ram[memory_address] = memory_data & 0xFF
+
+    def checked_ram_write(self, memory_data, memory_address):
+        """
+        Writes memory_data to index memory_address of the ram, raising
+        MemoryFault if the address is protected
+        """
+        # look up the kind of region the address belongs to
+        kind = self.fault_map[memory_address]
+        # fault on protected addresses
+        if kind is not None:
+            raise MemoryFault(kind, self.pc, memory_address)
+        # write memory_data with the writer protect replaced
+        self.unchecked_ram_write(memory_data, memory_address)
 
     def trace(self):
         """
@@ -159,60 +264,73 @@ class CPU:
 
         print()
 
-    def run(self):
-        """Run the CPU."""
-        # loop while True
-        while True:
-            # read a copy of the current instruction and
-            # store it in the a variable IR
-            IR = self.ram_read(self.pc)
-            # reset the instruction_size to 1
-            self.instruction_size = 1
-            # read byte at PC + 1 and store it in operand_a
-            operand_a = self.ram_read(self.pc + 1)
-            # read byte at PC + 2 and store it in operand_b
-            operand_b = self.ram_read(self.pc + 2)
-
-            # the third bit in the IR indicates if the operation is to
-            # be performed by the ALU, we have to extract it
-            # mask IR by 00100000
-            masked_IR = IR & 0b00100000
-            # bitwise shift it to the right 5 times and store the result in is_alu_operation
-            is_alu_operation = masked_IR >> 5
-
-            # some opcode sets the PC, we need to check for those
-            # bitwise shift IR to the right 4 times
-            shifted_IR = IR >> 4
-            # mask the result with 0001 and save it in sets_pc
-            sets_pc = shifted_IR & 0b0001
-
-            # check if is_alu_operation is true
-            if is_alu_operation:
-                # call alu with IR, operand_a, operand_b
-                self.alu(IR, operand_a, operand_b)
-
-            # if not an alu operation,
-            # check if present in branch_table
-            elif IR in self.branch_table:
-                # call branch table at index IR, and pass in operand_a and operand_b as args.
-                self.branch_table[IR](operand_a, operand_b)
-
-            # otherwise, that is a bad opcode
-            else:
-                print(f"Does not recognize command {IR}")
-                # call sys.exit with 2
-                sys.exit(2)
-
-            # check if current opcode does not set the PC
-            if not sets_pc:
-                # increment instruction size by the operand size
-                self.instruction_size += IR >> 6
-                # add the value of instruction_size to the register PC
-                self.pc += self.instruction_size
+    def run(self, budget=None):
+        """Run the CPU, for at most budget instructions if given."""
+        # check if the run is unbounded
+        if budget is None:
+            # loop until a HLT instruction halts the CPU
+            while not self.halted:
+                # execute the instruction at PC
+                self.step()
+        else:
+            # loop until halted or out of budget
+            for _ in range(budget):
+                if self.halted:
+                    break
+                self.step()
+
+    def step(self):
+        """Fetch, decode and execute a single instruction."""
+        # read a copy of the current instruction and
+        # store it in the a variable IR
+        IR = self.ram_read(self.pc)
+        # reset the instruction_size to 1
+        self.instruction_size = 1
+        # read byte at PC + 1 and store it in operand_a
+        operand_a = self.ram_read(self.pc + 1)
+        # read byte at PC + 2 and store it in operand_b
+        operand_b = self.ram_read(self.pc + 2)
+
+        # the third bit in the IR indicates if the operation is to
+        # be performed by the ALU, we have to extract it
+        # mask IR by 00100000
+        masked_IR = IR & 0b00100000
+        # bitwise shift it to the right 5 times and store the result in is_alu_operation
+        is_alu_operation = masked_IR >> 5
+
+        # some opcode sets the PC, we need to check for those
+        # bitwise shift IR to the right 4 times
+        shifted_IR = IR >> 4
+        # mask the result with 0001 and save it in sets_pc
+        sets_pc = shifted_IR & 0b0001
+
+        # check if is_alu_operation is true
+        if is_alu_operation:
+            # call alu with IR, operand_a, operand_b
+            self.alu(IR, operand_a, operand_b)
+
+        # if not an alu operation,
+        # check if present in branch_table
+        elif IR in self.branch_table:
+            # call branch table at index IR, and pass in self, operand_a and operand_b as args.
+            self.branch_table[IR](self, operand_a, operand_b)
+
+        # otherwise, that is a bad opcode
+        else:
+            print(f"Does not recognize command {IR}")
+            # call sys.exit with 2
+            sys.exit(2)
+
+        # check if current opcode does not set the PC
+        if not sets_pc:
+            # increment instruction size by the operand size
+            self.instruction_size += IR >> 6
+            # add the value of instruction_size to the register PC
+            self.pc += self.instruction_size
 
     def handle_hlt(self, opr1, opr2):
-        # call sys.exit with a zero as parameter
-        sys.exit(0)
+        # mark the CPU as halted so run stops fetching instructions
+        self.halted = True
 
     def handle_ldi(self, opr1, opr2):
         # set self.reg at index opr1 to opr2
@@ -292,6 +410,17 @@ class CPU:
         # call ram_write and pass it reg[opr2] as memory data and reg[opr1] as memory address
         self.ram_write(self.reg[opr2], self.reg[opr1])
 
+    def handle_tas(self, opr1, opr2):
+        # the address to test and set is stored in reg[opr2]
+        address = self.reg[opr2]
+        # hold the lock, if any, so no other core writes in between. Without
+        # a lock this core is the only one touching memory at a time
+        with self.lock or contextlib.nullcontext():
+            # read the old value into reg[opr1]
+            self.reg[opr1] = self.ram_read(address)
+            # and set the memory cell to 1
+            self.ram_write(1, address)
+
     # ALU methods
 
     def handle_add(self, reg_a, reg_b):
@@ -331,3 +460,26 @@ class CPU:
     def handle_xor(self, reg_a, reg_b):
         # bitwise xor the values in reg_a and reg_b and store the result in reg_a
         self.reg[reg_a] = self.reg[reg_a] ^ self.reg[reg_b]
+
+    # set up the branch table once for every CPU, mapping each opcode to
+    # the plain function that handles it
+    branch_table = {
+        HLT: handle_hlt,
+        LDI: handle_ldi,
+        PRN: handle_prn,
+        PUSH: handle_push,
+        POP: handle_pop,
+        CALL: handle_call,
+        RET: handle_ret,
+        MUL: handle_mul,
+        ADD: handle_add,
+        CMP: handle_cmp,
+        JMP: handle_jmp,
+        JEQ: handle_jeq,
+        JNE: handle_jne,
+        ST: handle_st,
+        AND: handle_and,
+        OR: handle_or,
+        XOR: handle_xor,
+        TAS: handle_tas
+    }
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+"""
+Differential testing of the assemblers and execution engines.
+
+Random valid programs are assembled with both asm/asm.py and asm/asm.js,
+whose outputs must be byte-identical, then run on every execution engine.
+Each engine must finish in the same state as the reference interpreter.
+Finally examples/spinloop.ls8 runs on several processes to check that TAS
+stays atomic with respect to plain stores.
+
+    python difftest.py -n 500 --jobs 4
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import CPU
+from profiler import Profiler
+from system import System, has_shared_memory
+
+# Where the assemblers live
+ASM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "asm")
+
+sys.path.insert(0, ASM_DIR)
+import asm  # noqa: E402
+
+# Registers the generator computes with, R6 holds addresses and R7 is SP
+DATA_REGS = ["R0", "R1", "R2", "R3", "R4", "R5"]
+
+# ALU instructions taking two registers
+ALU_OPS = ["ADD", "MUL", "AND", "OR", "XOR", "CMP"]
+
+# Conditional and unconditional jumps
+JUMP_OPS = ["JMP", "JEQ", "JNE"]
+
+# The number of data bytes the programs can ST and TAS into
+DATA_SIZE = 4
+
+# The deepest the generated programs push the stack
+MAX_STACK = 8
+
+# The program taking and releasing a spinlock in a loop on every core
+SPINLOOP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "examples", "spinloop.ls8")
+
+
+def generate(rng, length=40):
+    """
+    Generate the source of a random valid program. Jumps only go forward and
+    every PUSH is matched by a POP, so the program always reaches HLT.
+    """
+    lines = []
+    # the number of forward labels created so far
+    labels = 0
+    # the labels jumped to but not placed yet
+    pending = []
+    # the number of values currently pushed
+    depth = 0
+
+    def reg():
+        return rng.choice(DATA_REGS)
+
+    for _ in range(length):
+        kind = rng.randrange(10)
+
+        if kind == 0:
+            lines.append(f"LDI {reg()},{rng.randrange(256)}")
+        elif kind == 1:
+            lines.append(f"LDI {reg()},0x{rng.randrange(256):X}")
+        elif kind in (2, 3):
+            lines.append(f"{rng.choice(ALU_OPS)} {reg()},{reg()}")
+        elif kind == 4:
+            lines.append(f"PRN {reg()}")
+        elif kind == 5:
+            # keep the stack balanced and out of the program
+            if depth < MAX_STACK and rng.randrange(2):
+                lines.append(f"PUSH {reg()}")
+                depth += 1
+            elif depth > 0:
+                lines.append(f"POP {reg()}")
+                depth -= 1
+        elif kind == 6:
+            lines.append(f"LDI R6,Data{rng.randrange(DATA_SIZE)}")
+            lines.append(rng.choice([f"ST R6,{reg()}", f"TAS {reg()},R6"]))
+        elif kind == 7:
+            lines.append("LDI R6,Sub")
+            lines.append("CALL R6")
+        elif kind == 8:
+            label = f"Skip{labels}"
+            labels += 1
+            pending.append(label)
+            lines.append(f"LDI R6,{label}")
+            lines.append(f"{rng.choice(JUMP_OPS)} R6")
+        elif pending:
+            # place one of the pending labels here
+            lines.append(f"{pending.pop(rng.randrange(len(pending)))}:")
+
+    # place the remaining labels before halting
+    lines.extend(f"{label}:" for label in pending)
+    # unwind the stack
+    lines.extend(f"POP {reg()}" for _ in range(depth))
+    lines.append("HLT")
+
+    # a subroutine doing some arithmetic
+    lines.append("Sub:")
+    for _ in range(rng.randrange(1, 4)):
+        lines.append(f"{rng.choice(ALU_OPS)} {reg()},{reg()}")
+    lines.append("RET")
+
+    # the data bytes, in decimal or hex since asm.js does not parse 0b
+    for i in range(DATA_SIZE):
+        value = rng.randrange(256)
+        lines.append(f"Data{i}: DB {rng.choice([str(value), hex(value)])}")
+
+    return "\n".join(lines) + "\n"
+
+
+def assemble_py(source):
+    """Assemble source with asm.py and return the .ls8 text."""
+    sym = {}
+    code = []
+    output = io.StringIO()
+    asm.pass1(io.StringIO(source), sym, code)
+    asm.pass2(output, sym, code)
+    return output.getvalue()
+
+
+def assemble_js(source_path):
+    """Assemble the source file with asm.js and return the .ls8 text."""
+    result = subprocess.run(["node", os.path.join(ASM_DIR, "asm.js"),
+                             source_path],
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def snapshot(cpu, ram, output, status):
+    """Return the state engines are compared on."""
+    return {
+        "pc": cpu.pc,
+        "reg": list(cpu.reg),
+        "flag": cpu.flag,
+        "halted": cpu.halted,
+        "ram": list(ram),
+        "output": output,
+        "status": status,
+    }
+
+
+def run_engine(run, budget):
+    """
+    Call run(budget), which returns the (cpu, ram) to inspect, capturing the
+    output and how the program stopped
+    """
+    output = io.StringIO()
+    cpu = ram = None
+    status = "ok"
+
+    try:
+        with contextlib.redirect_stdout(output):
+            cpu, ram = run(budget)
+    except SystemExit as e:
+        status = f"exit {e.code}"
+    except Exception as e:
+        status = type(e).__name__
+
+    if cpu is None:
+        return {"output": output.getvalue(), "status": status}
+    return snapshot(cpu, ram, output.getvalue(), status)
+
+
+def engine_reference(filename):
+    """The reference interpreter, CPU.run."""
+    def run(budget):
+        cpu = CPU()
+        cpu.load(filename)
+        cpu.run(budget)
+        return cpu, cpu.ram
+    return run
+
+
+def engine_profiler(filename):
+    """The sampling profiler, sampling often to exercise the instrumented path."""
+    def run(budget):
+        cpu = CPU()
+        cpu.load(filename)
+        Profiler(cpu, interval=3).run(budget)
+        return cpu, cpu.ram
+    return run
+
+
+def engine_system(filename):
+    """A single core system interleaved on the current thread."""
+    def run(budget):
+        system = System(cores=1)
+        system.load(filename)
+        system.run(quantum=5, budget=budget)
+        return system.cores[0], system.ram
+    return run
+
+
+def engine_parallel(filename):
+    """A single core system running in its own process over shared memory."""
+    def run(budget):
+        system = System(cores=1)
+        system.load(filename)
+
+        # the core prints from another process, so capture the output at
+        # the file descriptor level and hand it to the current sys.stdout
+        captured = sys.stdout
+        sys.stdout = sys.__stdout__
+        sys.stdout.flush()
+        saved_fd = os.dup(1)
+        with tempfile.TemporaryFile(mode="w+") as f:
+            os.dup2(f.fileno(), 1)
+            try:
+                system.run_parallel(budget=budget)
+            finally:
+                sys.stdout.flush()
+                os.dup2(saved_fd, 1)
+                os.close(saved_fd)
+                sys.stdout = captured
+            f.seek(0)
+            captured.write(f.read())
+
+        return system.cores[0], system.ram
+    return run
+
+
+# The execution engines checked against the reference interpreter
+ENGINES = {
+    "profiler": engine_profiler,
+    "system": engine_system,
+}
+
+# The process-based engine needs multiprocessing.shared_memory
+if has_shared_memory():
+    ENGINES["parallel"] = engine_parallel
+
+
+def check(seed, budget, use_js):
+    """
+    Generate, assemble and run the program for seed. Returns a list of
+    mismatches, empty if everything agreed.
+    """
+    rng = random.Random(seed)
+    source = generate(rng)
+    mismatches = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source_path = os.path.join(tmp, "prog.asm")
+        program_path = os.path.join(tmp, "prog.ls8")
+
+        with open(source_path, "w") as f:
+            f.write(source)
+
+        # both assemblers must produce the same bytes
+        program = assemble_py(source)
+        if use_js and assemble_js(source_path) != program:
+            mismatches.append("asm.py and asm.js outputs differ")
+
+        with open(program_path, "w") as f:
+            f.write(program)
+
+        # every engine must agree with the reference interpreter
+        expected = run_engine(engine_reference(program_path), budget)
+        for name, engine in ENGINES.items():
+            actual = run_engine(engine(program_path), budget)
+            for key in expected:
+                if actual.get(key) != expected[key]:
+                    mismatches.append(f"{name}: {key} differs")
+
+    return seed, mismatches
+
+
+def check_spinloop(cores=4, budget=500000):
+    """
+    Run the spinlock loop on cores host processes. Returns a list of
+    problems, empty if every core halted and the lock ended up free.
+    """
+    system = System(cores=cores)
+    system.load(SPINLOOP)
+    system.run_parallel(budget=budget)
+
+    problems = [f"core {core_id} did not halt, PC {core.pc}"
+                for core_id, core in enumerate(system.cores)
+                if not core.halted]
+    # the lock is the last byte of the program
+    lock = system.ram[system.cores[0].program_size - 1]
+    if lock != 0:
+        problems.append(f"lock left at {lock}")
+
+    return problems
+
+
+def main(argv):
+    # instantiate the argument parser
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--cases", type=int, default=200,
+                        help="The number of random programs to check")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="The seed of the first program")
+    parser.add_argument("--budget", type=int, default=10000,
+                        help="The most instructions a program may execute")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="The number of worker processes")
+    args = parser.parse_args(argv[1:])
+
+    # the JS assembler is only checked when node is installed
+    use_js = shutil.which("node") is not None
+    if not use_js:
+        print("node not found, skipping asm.js comparison", file=sys.stderr)
+
+    # the parallel engine and spinloop check need shared memory
+    use_parallel = has_shared_memory()
+    if not use_parallel:
+        print("multiprocessing.shared_memory not found, skipping the parallel "
+              "engine and spinloop check", file=sys.stderr)
+
+    seeds = range(args.seed, args.seed + args.cases)
+    failures = 0
+
+    # check the cases in parallel across a process pool
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(check, seed, args.budget, use_js)
+                   for seed in seeds]
+        for future in futures:
+            seed, mismatches = future.result()
+            if mismatches:
+                failures += 1
+                print(f"seed {seed}: {', '.join(mismatches)}")
+
+    print(f"{args.cases - failures}/{args.cases} cases agreed")
+
+    # TAS must stay atomic with respect to plain stores from other cores
+    if use_parallel:
+        problems = check_spinloop()
+        if problems:
+            failures += 1
+            print(f"spinloop: {', '.join(problems)}")
+        else:
+            print("spinloop: every core halted with the lock free")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -2,24 +2,214 @@
 
 """Main."""
 
-import sys
-import argparse
-from cpu import *
+import time
 
-# instantiate the argument parser
-parser = argparse.ArgumentParser()
+# the wall clock time the script started at, for --startup-time. Time spent
+# by the interpreter before running the script is not included, time the
+# whole command externally to see it
+START = time.perf_counter()
 
-# add the filename argument to the parser
-parser.add_argument("filename", help="The name of the file to be executed")
+import sys  # noqa: E402
+from cpu import CPU, MemoryFault  # noqa: E402
 
-# parse to get the argument
-args = parser.parse_args()
+USAGE = ("usage: ls8.py [--cores N] [--parallel] [--startup-time] filename\n"
+         "       ls8.py [--protect-code START-END] [--protect-vectors] "
+         "[--stack-limit ADDR]\n"
+         "              [--profile N] filename\n"
+         "       ls8.py --serve socket [--budget N]")
 
-# instantiate the CPU
-cpu = CPU()
 
-# load a program with name <filename>
-cpu.load(args.filename)
+def parse_commandline(argv):
+    """
+    Parse the command line by hand, building an argparse parser costs more
+    than running most programs
+    """
 
-# execute the program by calling the run method
-cpu.run()
+    # set up the defaults
+    options = {
+        "filename": None,
+        "cores": 1,
+        "parallel": False,
+        "serve": None,
+        "budget": None,
+        "startup_time": False,
+        "profile": None,
+        "protect_vectors": False,
+        "protect_code": None,
+        "stack_limit": None,
+    }
+
+    # walk the arguments after the script name
+    args = iter(argv[1:])
+
+    try:
+        for arg in args:
+            if arg == "--cores":
+                options["cores"] = int(next(args))
+                # there must be at least one core
+                if options["cores"] < 1:
+                    raise ValueError(arg)
+            elif arg == "--parallel":
+                options["parallel"] = True
+            elif arg == "--serve":
+                options["serve"] = next(args)
+            elif arg == "--budget":
+                options["budget"] = int(next(args))
+            elif arg == "--startup-time":
+                options["startup_time"] = True
+            elif arg == "--profile":
+                options["profile"] = int(next(args))
+                # at most every instruction can be sampled
+                if options["profile"] < 1:
+                    raise ValueError(arg)
+            elif arg == "--protect-vectors":
+                options["protect_vectors"] = True
+            elif arg == "--protect-code":
+                # the addresses holding instructions, END excluded
+                start, end = (int(a, 0) for a in next(args).split("-"))
+                if not 0 <= start <= end <= 256:
+                    raise ValueError(arg)
+                options["protect_code"] = (start, end)
+            elif arg == "--stack-limit":
+                options["stack_limit"] = int(next(args), 0)
+                # the guard byte below the limit must be in memory
+                if not 1 <= options["stack_limit"] <= 0xFF:
+                    raise ValueError(arg)
+            elif arg.startswith("-") or options["filename"] is not None:
+                raise ValueError(arg)
+            else:
+                options["filename"] = arg
+    except (StopIteration, ValueError):
+        print(USAGE, file=sys.stderr)
+        sys.exit(1)
+
+    # protection and profiling only apply to a single core run locally
+    single_core_only = (options["protect_vectors"]
+                        or options["protect_code"] is not None
+                        or options["stack_limit"] is not None
+                        or options["profile"] is not None)
+    multi_core = options["cores"] > 1 or options["parallel"]
+    if single_core_only and (multi_core or options["serve"] is not None):
+        print(USAGE, file=sys.stderr)
+        sys.exit(1)
+
+    # the budget only bounds the programs run by the server
+    if options["budget"] is not None and options["serve"] is None:
+        print(USAGE, file=sys.stderr)
+        sys.exit(1)
+
+    # a filename is needed unless serving
+    if options["filename"] is None and options["serve"] is None:
+        print(USAGE, file=sys.stderr)
+        sys.exit(1)
+
+    return options
+
+
+def report_startup(options):
+    """
+    Print the wall clock time from the start of the script to now, called
+    right before the first instruction runs
+    """
+    if options["startup_time"]:
+        elapsed = (time.perf_counter() - START) * 1000
+        print(f"startup: {elapsed:.1f} ms", file=sys.stderr)
+
+
+def main(argv):
+    # parse to get the options
+    options = parse_commandline(argv)
+
+    # check if a persistent server was requested
+    if options["serve"] is not None:
+        # only import the server when it is needed
+        from server import serve, SERVER_BUDGET
+
+        # serve programs until interrupted
+        if options["budget"] is None:
+            options["budget"] = SERVER_BUDGET
+        serve(options["serve"], options["budget"])
+        return 0
+
+    # check if more than one core was requested
+    if options["cores"] > 1 or options["parallel"]:
+        # only import the multi-core system when it is needed
+        from system import System, has_shared_memory
+
+        # parallel cores share memory through multiprocessing.shared_memory
+        if options["parallel"] and not has_shared_memory():
+            print("Error: --parallel needs Python 3.8 or later",
+                  file=sys.stderr)
+            return 1
+
+        try:
+            # instantiate the system
+            system = System(cores=options["cores"])
+
+            # load a program with name <filename> into the shared memory
+            system.load(options["filename"])
+        except ValueError as e:
+            # too many cores for their stacks to fit next to the program
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+
+        # report the startup time right before the cores start
+        report_startup(options)
+
+        # run the cores in parallel or interleaved on this thread
+        if options["parallel"]:
+            system.run_parallel()
+        else:
+            system.run()
+
+        return 0
+
+    # instantiate the CPU
+    cpu = CPU()
+
+    # load a program with name <filename>
+    cpu.load(options["filename"])
+
+    # protect the code, the interrupt vectors and the stack limit
+    if (options["protect_vectors"] or options["protect_code"] is not None
+            or options["stack_limit"] is not None):
+        cpu.protect(code=options["protect_code"],
+                    stack_limit=options["stack_limit"],
+                    vectors=options["protect_vectors"])
+
+    try:
+        # check if a profile was requested
+        if options["profile"] is not None:
+            # only import the profiler when it is needed
+            from profiler import Profiler
+
+            # sample the CPU every N instructions
+            profiler = Profiler(cpu, interval=options["profile"])
+
+            # report the startup time right before the first instruction
+            report_startup(options)
+
+            try:
+                # execute the program under the profiler
+                profiler.run()
+            finally:
+                # report even if the program stopped on a bad opcode or fault
+                profiler.report()
+
+        else:
+            # report the startup time right before the first instruction
+            report_startup(options)
+
+            # execute the program by calling the run method
+            cpu.run()
+
+    except MemoryFault as fault:
+        # report the write that hit a protected region
+        print(f"Error: {fault}", file=sys.stderr)
+        return 3
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,194 @@
+"""Sampling profiler for LS-8 programs."""
+
+import sys
+
+# Characters used to shade the heatmaps, from cold to hot
+SHADES = " .:-=+*#%@"
+
+
+class Profiler:
+    """
+    Samples a CPU every interval instructions. Only the sampled instruction
+    is instrumented, every other instruction runs at full speed
+    """
+
+    def __init__(self, cpu, interval=1000):
+        """Construct a profiler for cpu sampling every interval instructions."""
+        # at most every instruction can be sampled
+        if interval < 1:
+            raise ValueError(
+                f"Expected an interval of at least 1, got {interval}")
+
+        # the CPU being profiled
+        self.cpu = cpu
+        # the number of instructions between two samples
+        self.interval = interval
+        # the total number of instructions executed
+        self.instructions = 0
+        # the number of samples taken at each PC
+        self.pc_samples = [0] * 256
+        # the number of sampled reads and writes at each address
+        self.reads = [0] * 256
+        self.writes = [0] * 256
+        # the stack depth at every sample as (instructions, depth) pairs
+        self.stack_depth = []
+        # the stack pointer when profiling started, the base of the stack
+        self.stack_base = cpu.reg[7]
+
+    def run(self, budget=None):
+        """
+        Run the CPU to completion, or for at most budget instructions if
+        given, sampling it along the way
+        """
+        # look the step method up once for the unsampled instructions
+        cpu = self.cpu
+        step = cpu.step
+        # execute interval - 1 instructions between samples
+        skip = self.interval - 1
+
+        # loop until a HLT instruction halts the CPU
+        while not cpu.halted:
+            # stop early when the budget would run out before the next sample
+            if budget is not None:
+                remaining = budget - self.instructions
+                if remaining <= skip:
+                    for _ in range(remaining):
+                        if cpu.halted:
+                            break
+                        step()
+                        self.instructions += 1
+                    return
+            # run the unsampled instructions at full speed
+            for _ in range(skip):
+                step()
+                self.instructions += 1
+                if cpu.halted:
+                    return
+            # run the sampled instruction with instrumentation
+            self.sample()
+
+    def sample(self):
+        """Record the state of the CPU and execute one instrumented step."""
+        cpu = self.cpu
+        # record where the CPU is and how deep the stack is
+        self.pc_samples[cpu.pc] += 1
+        self.stack_depth.append((self.instructions,
+                                 self.stack_base - cpu.reg[7]))
+
+        # remember the memory accessors currently in use, and whether they
+        # were set on the instance rather than the class
+        read, write = cpu.ram_read, cpu.ram_write
+        saved = {name: cpu.__dict__[name] for name in ("ram_read", "ram_write")
+                 if name in cpu.__dict__}
+
+        def counting_read(memory_address):
+            self.reads[memory_address] += 1
+            return read(memory_address)
+
+        def counting_write(memory_data, memory_address):
+            self.writes[memory_address] += 1
+            write(memory_data, memory_address)
+
+        # count the memory accesses of this step only
+        cpu.ram_read = counting_read
+        cpu.ram_write = counting_write
+
+        try:
+            cpu.step()
+            self.instructions += 1
+        finally:
+            # put the original accessors back
+            del cpu.ram_read
+            del cpu.ram_write
+            cpu.__dict__.update(saved)
+
+    def label_for(self, address):
+        """Return the closest label at or before address."""
+        # find the highest labelled address not after address
+        candidates = [a for a in self.cpu.labels if a <= address]
+        if not candidates:
+            return "(start)"
+        return self.cpu.labels[max(candidates)]
+
+    def hotspots(self):
+        """
+        Return the samples per label as a list of (label, address, samples),
+        hottest first
+        """
+        # add up the samples of every address under its label
+        totals = {}
+        for address, samples in enumerate(self.pc_samples):
+            if samples:
+                label = self.label_for(address)
+                totals[label] = totals.get(label, 0) + samples
+
+        # find the address of every label for the table
+        addresses = {name: address for address, name in self.cpu.labels.items()}
+        rows = [(label, addresses.get(label, 0), samples)
+                for label, samples in totals.items()]
+
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def report(self, file=sys.stderr):
+        """Print the hotspot table, heatmaps and stack depth to file."""
+        total = sum(self.pc_samples)
+
+        print(f"Profile: {self.instructions} instructions, {total} samples "
+              f"every {self.interval}", file=file)
+
+        # print the hotspot table
+        print(file=file)
+        print(f"{'label':<16} {'addr':>4} {'samples':>8} {'%':>6}", file=file)
+        for label, address, samples in self.hotspots():
+            print(f"{label:<16} {address:>4} {samples:>8} "
+                  f"{100 * samples / total:>6.1f}", file=file)
+
+        # print a heatmap per kind of access
+        for title, counts in (("PC samples", self.pc_samples),
+                              ("RAM reads", self.reads),
+                              ("RAM writes", self.writes)):
+            print(file=file)
+            print_heatmap(title, counts, file)
+
+        # print the stack depth over time
+        print(file=file)
+        print_stack_depth(self.stack_depth, file)
+
+
+def shade(value, highest):
+    """Return the shade character of value on a scale up to highest."""
+    if value <= 0 or highest <= 0:
+        return SHADES[0]
+    # never use the blank shade for a non zero value
+    return SHADES[max(1, value * (len(SHADES) - 1) // highest)]
+
+
+def print_heatmap(title, counts, file):
+    """Print the 256 counts as a 16x16 grid, one row per 16 addresses."""
+    highest = max(counts)
+
+    print(f"{title} (max {highest}):", file=file)
+    print("     " + "".join(f"{column:X}" for column in range(16)), file=file)
+    for row in range(16):
+        cells = counts[row * 16:row * 16 + 16]
+        line = "".join(shade(count, highest) for count in cells)
+        print(f"  {row * 16:02X} {line}", file=file)
+
+
+def print_stack_depth(stack_depth, file, width=64):
+    """Print the sampled stack depth over time, squeezed into width columns."""
+    if not stack_depth:
+        print("Stack depth: no samples", file=file)
+        return
+
+    depths = [depth for _, depth in stack_depth]
+    highest = max(depths)
+
+    print(f"Stack depth (max {highest}, last {depths[-1]}):", file=file)
+
+    # keep the deepest sample of every column
+    per_column = -(-len(depths) // width)
+    columns = [max(depths[i:i + per_column])
+               for i in range(0, len(depths), per_column)]
+    print("  " + "".join(shade(depth, highest) for depth in columns),
+          file=file)
@@ -0,0 +1,96 @@
+"""Persistent LS-8 server listening on a local Unix socket."""
+
+import io
+import os
+import socketserver
+import sys
+
+from cpu import CPU
+
+# The most instructions a program may execute by default, so a program that
+# never halts can not keep its forked child alive forever
+SERVER_BUDGET = 10000000
+
+
+class ProgramHandler(socketserver.StreamRequestHandler):
+    """
+    Runs the .ls8 program sent by a client and streams its output back.
+
+    The client sends the program text and shuts down its side of the
+    connection, e.g.
+
+        socat - UNIX-CONNECT:/tmp/ls8.sock < examples/print8.ls8
+
+    The response ends with a status line, "status: <code> <message>", where
+    code is 0 once the program halted, 1 for a program that could not be
+    loaded or crashed the emulator, 2 for a bad opcode and 124 when the
+    program ran out of instruction budget.
+    """
+
+    def handle(self):
+        # read the whole program until the client is done sending
+        lines = self.rfile.read().decode().splitlines()
+        # send everything the program prints back to the client
+        output = io.TextIOWrapper(self.wfile, line_buffering=True)
+        sys.stdout = output
+
+        try:
+            # instantiate a fresh CPU for the program
+            cpu = CPU()
+            # load the program received
+            cpu.load_program(lines)
+            # execute the program, never for longer than the budget
+            cpu.run(self.server.budget)
+
+            if cpu.halted:
+                status = "0 halted"
+            else:
+                status = (f"124 out of budget after {self.server.budget} "
+                          "instructions")
+        except SystemExit as e:
+            # a bad opcode ends the program, not the server
+            status = f"{e.code} exited"
+        except Exception as e:
+            # report what went wrong to the client rather than the server
+            status = f"1 {type(e).__name__}: {e}"
+        finally:
+            sys.stdout = sys.__stdout__
+
+        try:
+            # tell the client how the program ended
+            output.write(f"status: {status}\n")
+            # make sure the client gets everything before the socket closes
+            output.flush()
+        finally:
+            output.detach()
+
+
+class ForkingUnixServer(socketserver.ForkingMixIn,
+                        socketserver.UnixStreamServer):
+    """
+    Serves every program in a forked child, so programs are isolated from
+    each other and from the server while skipping interpreter startup.
+    """
+
+    def __init__(self, socket_path, handler, budget):
+        super().__init__(socket_path, handler)
+        # the most instructions a single program may execute
+        self.budget = budget
+
+
+def serve(socket_path, budget=SERVER_BUDGET):
+    """
+    Serve programs on socket_path until interrupted, running each for at
+    most budget instructions
+    """
+    # remove a stale socket left behind by a previous server
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with ForkingUnixServer(socket_path, ProgramHandler, budget) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
@@ -0,0 +1,191 @@
+"""Multi-core LS-8 system."""
+
+import multiprocessing
+import queue
+
+from cpu import CPU
+
+
+def has_shared_memory():
+    """
+    Returns whether multiprocessing.shared_memory, which run_parallel needs,
+    is available. It was added in Python 3.8
+    """
+    try:
+        from multiprocessing import shared_memory  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run_core(shm_name, lock, core_id, pc, sp, budget, results):
+    """
+    Entry point of a core running in its own host process. Attaches to the
+    shared memory block by name and runs until the core halts or runs out of
+    budget
+    """
+    # shared_memory needs Python 3.8, only import it for parallel runs
+    from multiprocessing import shared_memory
+
+    # attach to the ram shared by every core
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # build the core on top of the shared ram
+    core = CPU(ram=shm.buf, lock=lock)
+    # set the per-core program counter and stack pointer
+    core.pc = pc
+    core.reg[7] = sp
+    # run until HLT
+    core.run(budget)
+    # report the final state of the core back to the parent
+    results.put((core_id, core.pc, list(core.reg), core.flag, core.halted))
+    # drop the core so it releases its view of the shared buffer
+    del core
+    # detach from the shared memory, the parent unlinks it
+    shm.close()
+
+
+class System:
+    """Several LS-8 cores sharing a single RAM."""
+
+    def __init__(self, cores=2, entry_points=None, stack_size=16):
+        """
+        Construct a system with the number of cores given. Every core starts at
+        its entry point (address 0 by default) and gets its own stack of
+        stack_size bytes carved downward from 0xF4
+        """
+        # there must be at least one core
+        if cores < 1:
+            raise ValueError(f"Expected at least one core, got {cores}")
+
+        # the lowest address the stacks of every core may grow down to
+        self.stack_bottom = 0xF4 - cores * stack_size
+
+        # the stacks must fit in memory
+        if self.stack_bottom < 0:
+            raise ValueError(f"The stacks of {cores} cores do not fit in memory")
+
+        # start every core at address 0 unless told otherwise
+        if entry_points is None:
+            entry_points = [0] * cores
+
+        # every core needs exactly one entry point
+        if len(entry_points) != cores:
+            raise ValueError("Expected one entry point per core")
+
+        # the ram shared by every core when interleaved on one thread,
+        # run_parallel copies it into a shared memory block
+        self.ram = [0] * 256
+        # set up the cores, all of them sharing self.ram
+        self.cores = []
+
+        # loop through every core
+        for core_id in range(cores):
+            core = CPU(ram=self.ram)
+            # set the core's program counter to its entry point
+            core.pc = entry_points[core_id]
+            # give every core its own stack below the previous one
+            core.reg[7] = 0xF4 - core_id * stack_size
+            self.cores.append(core)
+
+    def load(self, filename):
+        """Load a program into the shared memory."""
+        # any core can load, since they all share the same ram
+        self.cores[0].load(filename)
+
+        # the stacks must not grow into the program
+        if self.stack_bottom < self.cores[0].program_size:
+            raise ValueError(
+                f"The stacks of {len(self.cores)} cores reach into the program")
+
+    def run(self, quantum=1, budget=None):
+        """
+        Interleave the cores deterministically on the current thread. Every
+        running core executes quantum instructions per turn, in core order,
+        until all of them have halted or executed budget instructions
+        """
+        # the number of instructions executed by every core
+        executed = [0] * len(self.cores)
+
+        # check if a core can still run
+        def runnable(core_id):
+            if self.cores[core_id].halted:
+                return False
+            return budget is None or executed[core_id] < budget
+
+        # loop while at least one core is still running
+        while any(runnable(core_id) for core_id in range(len(self.cores))):
+            # give every core a turn
+            for core_id, core in enumerate(self.cores):
+                # run up to quantum instructions on the core
+                for _ in range(quantum):
+                    # stop early if the core halted or ran out of budget
+                    if not runnable(core_id):
+                        break
+                    core.step()
+                    executed[core_id] += 1
+
+    def run_parallel(self, budget=None):
+        """
+        Run every core in its own host process on top of shared memory, each
+        for at most budget instructions if given. The cores' registers are
+        updated with their final state once all of them have stopped.
+        Needs Python 3.8 or later for multiprocessing.shared_memory
+        """
+        # shared_memory needs Python 3.8, only import it for parallel runs
+        if not has_shared_memory():
+            raise RuntimeError("Parallel cores need Python 3.8 or later")
+        from multiprocessing import shared_memory
+
+        # allocate a shared block of 256 bytes
+        shm = shared_memory.SharedMemory(create=True, size=256)
+        # copy the loaded program into the shared block
+        shm.buf[:256] = bytes(self.ram)
+        # the lock taken by every write to the shared block, reentrant since
+        # TAS writes while holding it
+        lock = multiprocessing.RLock()
+        # the queue used by the cores to report their final state
+        results = multiprocessing.Queue()
+
+        # start a host process per core
+        processes = []
+        for core_id, core in enumerate(self.cores):
+            process = multiprocessing.Process(
+                target=run_core,
+                args=(shm.name, lock, core_id, core.pc, core.reg[7], budget,
+                      results)
+            )
+            process.start()
+            processes.append(process)
+
+        # collect the final state of every core before joining, so a full
+        # queue can not block a child from exiting
+        collected = 0
+        failed = []
+        while collected + len(failed) < len(processes):
+            try:
+                core_id, pc, reg, flag, halted = results.get(timeout=0.1)
+            except queue.Empty:
+                # a core that exited with an error will never report back
+                failed = [core_id for core_id, process in enumerate(processes)
+                          if process.exitcode not in (None, 0)]
+                continue
+            core = self.cores[core_id]
+            core.pc = pc
+            core.reg = reg
+            core.flag = flag
+            core.halted = halted
+            collected += 1
+
+        # wait for every process to finish
+        for process in processes:
+            process.join()
+
+        # copy the shared memory back so the final image can be inspected
+        self.ram[:] = shm.buf[:256]
+        # release the shared block
+        shm.close()
+        shm.unlink()
+
+        # report any core that did not halt cleanly
+        if failed:
+            raise RuntimeError(f"Cores {failed} exited with an error")